@@ -1,50 +1,285 @@
+import asyncio
+import logging
 import os
-from datetime import datetime, timedelta
-import pytz # Pastikan Anda punya pip install pytz
+import re
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta, timezone
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
+from telegram.helpers import escape_markdown
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     CommandHandler,
     ContextTypes,
-    CallbackQueryHandler,
-    filters
+    CallbackQueryHandler
 )
-from supabase import create_client
-from flask import Flask, request
+from dotenv import load_dotenv
+from functools import lru_cache
+from typing import NamedTuple
+
+# --- Logging ---
+# Logger modul dibuat sekali di sini; jangan pakai print() di handler.
+# httpx dinaikkan ke WARNING supaya log tidak banjir satu baris per request.
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
 
 # --- Konfigurasi ---
-TOKEN = os.getenv("BOT_TOKEN")
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+load_dotenv() # Baca .env saat jalan lokal; di Render env sudah tersedia
+
+# Seluruh konfigurasi dibaca sekali di sini lalu dibekukan dalam NamedTuple
+# immutable; tidak ada os.getenv tersebar di jalur runtime, dan salah ketik
+# nama field langsung AttributeError alih-alih diam-diam None.
+class Config(NamedTuple):
+    token: str
+    supabase_url: str
+    supabase_key: str
+    webhook_url: str
+    port: int
+    webhook_secret: str
+    owner_ids: frozenset
+
+CONFIG = Config(
+    token=os.getenv("BOT_TOKEN"),
+    supabase_url=os.getenv("SUPABASE_URL"),
+    supabase_key=os.getenv("SUPABASE_KEY"),
+    webhook_url=os.getenv("WEBHOOK_URL"),
+    port=int(os.getenv("PORT", 8080)),
+    webhook_secret=os.getenv("WEBHOOK_SECRET"),
+    # Daftar user id pemilik bot, dipisah koma, dibekukan sebagai frozenset
+    # sekali di sini supaya cek keanggotaannya O(1) tanpa parsing ulang.
+    owner_ids=frozenset(
+        int(uid) for uid in os.getenv("OWNER_IDS", "").split(",") if uid.strip()
+    ),
+)
 
 # --- Inisialisasi ---
-bot_app = Application.builder().token(TOKEN).build()
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-flask_app = Flask(__name__)
+# Client Supabase dibuat malas dan di-cache: satu instance untuk seluruh
+# proses (lru_cache(maxsize=1) = singleton), dan import modul tidak lagi
+# gagal hanya karena env belum di-set.
+@lru_cache(maxsize=1)
+def get_supabase():
+    # Import di sini, bukan di atas: paket supabase menarik rantai dependensi
+    # yang lumayan berat dan baru dibutuhkan saat query pertama, jadi import
+    # modul ini (mis. oleh tooling) tetap ringan.
+    from supabase import create_client
+    return create_client(CONFIG.supabase_url, CONFIG.supabase_key)
 
 # --- Helper Functions ---
 
-# Fungsi untuk mendapatkan user ID dan chat ID dari username
+# Jalankan query Supabase di thread terpisah. Client supabase memakai httpx
+# sync, jadi .execute() memblokir event loop selama round-trip ke database;
+# lewat to_thread, handler lain tetap bisa jalan selama query menunggu.
+# Satu client dipakai bersama sehingga koneksi HTTP-nya di-pool ulang.
+async def run_db(query):
+    return await asyncio.to_thread(query.execute)
+
+# Daftar kolom select yang dipakai berulang, disusun sekali di scope modul
+# supaya teks query yang dikirim ke PostgREST selalu identik antar panggilan
+# (parameternya lewat eq(), bukan disisipkan ke string) dan server bisa
+# memakai ulang plan untuk bentuk query yang sama.
+# Teks pesan statis yang dipakai berulang, disusun sekali saat import
+# alih-alih dirangkai ulang di tiap panggilan handler.
+START_GREETING = "✅ Halo {}! Bot siap pakai. Anda bisa beri dan kelola tugas."
+ADD_USAGE = "Contoh: /add @user1 @user2 2025-12-31 Beli bahan presentasi"
+
+# Template baris daftar tugas; placeholder diisi lewat .format sehingga
+# literal template hanya disusun sekali saat import.
+MY_TASKS_HEADER = "📝 *Daftar Tugas Anda (Pending)*:\n"
+MY_TASK_LINE = (
+    "• ID: `{short_id}`\n"
+    "  Dari: {assigner}\n"
+    "  Tugas: *{task_text}*\n"
+    "  Deadline: {deadline}\n"
+)
+GIVEN_TASKS_HEADER = "📋 *Daftar Tugas yang Anda Berikan*:\n"
+GIVEN_TASK_LINE = (
+    "• ID: `{short_id}`\n"
+    "  Untuk: {assignee}\n"
+    "  Tugas: *{task_text}*\n"
+    "  Deadline: {deadline}\n"
+    "  Status: `{status}`\n"
+)
+
+USER_INFO_COLS = "id, chat_id"
+# Nama lawan transaksi ikut di-embed lewat FK (users!assigned_by /
+# users!assigned_to), jadi PostgREST mengerjakannya sebagai satu query
+# ber-JOIN — bukan satu lookup user per baris tugas dari sisi aplikasi.
+MY_TASK_COLS = "id, task_text, deadline, assigner:users!assigned_by(name)"
+GIVEN_TASK_COLS = "id, task_text, deadline, status, assignee:users!assigned_to(name)"
+
+# Batas baris per /list_*: menjaga query tetap terikat LIMIT (index scan
+# berhenti setelah N baris, bukan scan seluruh riwayat).
+LIST_LIMIT = 50
+# Telegram menolak pesan di atas 4096 karakter, dan task_text tidak dibatasi
+# panjangnya — tiap baris memuat pratinjau teks tugas saja, dan total render
+# dijaga di bawah anggaran karakter. Daftar yang terpotong (oleh LIMIT
+# ataupun anggaran) ditandai dengan catatan di bawahnya.
+TASK_TEXT_PREVIEW = 200
+LIST_CHAR_BUDGET = 3800
+LIST_TRUNCATED_NOTE = "\n_Sebagian tugas tidak ditampilkan._"
+
+# Cache TTL untuk lookup data user. Data user hampir tidak pernah berubah,
+# jadi mayoritas lookup (nama pemberi tugas di /list_my, dll.) bisa dijawab
+# dari memori tanpa round-trip ke Postgres. Hanya hasil yang ketemu yang
+# di-cache, supaya user yang baru /start langsung terlihat.
+_USER_CACHE_TTL = 60  # detik
+_USER_CACHE_MAX = 10_000  # batas ukuran supaya memori tidak tumbuh tanpa batas
+_user_cache = OrderedDict()
+
+# Cache ini hanya disentuh dari coroutine di event loop (run_db cuma
+# menjalankan .execute() di thread lain), jadi tidak perlu lock.
+def _cache_get(key):
+    entry = _user_cache.get(key)
+    if not entry:
+        return None
+    if time.monotonic() - entry[0] >= _USER_CACHE_TTL:
+        # Entri kedaluwarsa langsung dibuang, bukan menunggu tergusur LRU,
+        # supaya cache tidak penuh oleh entri mati.
+        _user_cache.pop(key, None)
+        return None
+    _user_cache.move_to_end(key)
+    return entry[1]
+
+def _cache_set(key, value):
+    _user_cache[key] = (time.monotonic(), value)
+    _user_cache.move_to_end(key)
+    if len(_user_cache) > _USER_CACHE_MAX:
+        _user_cache.popitem(last=False)
+
+# Snapshot id semua user terdaftar, dimuat sekali saat boot (post_init).
+# Cek "sudah pernah /start atau belum" jadi satu lookup set di memori,
+# bukan query per command. /start menambah anggotanya secara langsung.
+known_users = set()
+
+async def load_known_users():
+    response = await run_db(get_supabase().table("users").select("id"))
+    known_users.update(row['id'] for row in (response.data or []))
+    logger.info("Memuat %d user terdaftar ke memori.", len(known_users))
+
+# Cek keanggotaan user; kalau tidak ada di snapshot (misal bot baru
+# restart dan load awal gagal), jatuh ke query database sekali.
+# maybe_single: nol baris tidak melempar APIError seperti single(), tapi
+# execute()-nya mengembalikan None utuh — cek response-nya dulu supaya user
+# belum terdaftar sampai ke return False alih-alih ke on_error.
+async def is_registered(user_id):
+    if user_id in known_users:
+        return True
+    response = await run_db(
+        get_supabase().table("users").select("id").eq("id", user_id).maybe_single()
+    )
+    if response and response.data:
+        known_users.add(user_id)
+        return True
+    return False
+
+# Rate limiter per user: maksimal _RATE_LIMIT command per jendela
+# _RATE_WINDOW detik. Spam dipotong dengan hitungan di memori sebelum
+# sempat menyentuh database atau Telegram.
+_RATE_LIMIT = 20
+_RATE_WINDOW = 60.0  # detik
+_rate_buckets = {}  # user_id -> (awal_jendela, jumlah)
+
+def _rate_limited(user_id):
+    if user_id in CONFIG.owner_ids:
+        return False # Pemilik bot tidak pernah kena limit
+    now = time.monotonic()
+    start, count = _rate_buckets.get(user_id, (now, 0))
+    if now - start >= _RATE_WINDOW:
+        start, count = now, 0
+    count += 1
+    _rate_buckets[user_id] = (start, count)
+    if len(_rate_buckets) > 10_000:
+        # Buang jendela yang sudah lewat supaya map tidak tumbuh terus
+        expired = [u for u, (s, _) in _rate_buckets.items() if now - s >= _RATE_WINDOW]
+        for uid in expired:
+            del _rate_buckets[uid]
+    return count > _RATE_LIMIT
+
+RATE_LIMIT_MSG = "⏳ Terlalu banyak perintah. Tunggu sebentar lalu coba lagi."
+
+# Hasil render daftar tugas ikut di-cache (teks + keyboard) per user, jadi
+# /list_* yang diulang-ulang dijawab tanpa query dan tanpa format ulang.
+# Entri dibuang setiap kali ada penulisan yang mengubah daftar user terkait
+# (tugas baru, selesai, batal); TTL cache jadi sekadar jaring pengaman.
+def _invalidate_task_lists(assignee_ids, assigner_ids):
+    for uid in assignee_ids:
+        _user_cache.pop(("list_my", uid), None)
+    for uid in assigner_ids:
+        _user_cache.pop(("list_given", uid), None)
+
+# Bentuk deadline relatif satu token: "30menit", "12jam", "3hari".
+# Regex dikompilasi sekali di scope modul; dispatch unit lewat dict ke
+# argumen timedelta, tanpa rantai if atau strptime coba-coba.
+_REL_DEADLINE_RE = re.compile(r"(\d+)(menit|jam|hari)", re.IGNORECASE)
+_REL_UNITS = {"menit": "minutes", "jam": "hours", "hari": "days"}
+
+# Parser deadline khusus: bentuk relatif di atas, atau ISO 8601 lewat
+# fromisoformat (parser C tanpa format string; timezone.utc bawaan
+# menggantikan pytz, yang dipakai kode lama tapi tak pernah ada di
+# requirements). ValueError diteruskan ke pemanggil untuk pesan formatnya.
+def parse_deadline(deadline_str):
+    match = _REL_DEADLINE_RE.fullmatch(deadline_str.lower())
+    if match:
+        amount, unit = match.groups()
+        return datetime.now(timezone.utc) + timedelta(**{_REL_UNITS[unit]: int(amount)})
+    deadline = datetime.fromisoformat(deadline_str)
+    # Tanggal polos (YYYY-MM-DD, 10 karakter): tenggat sampai akhir hari UTC.
+    # Jam eksplisit dihormati apa adanya; hanya yang tanpa offset yang
+    # dianggap UTC.
+    if len(deadline_str) == 10:
+        return deadline.replace(hour=23, minute=59, second=59, tzinfo=timezone.utc)
+    if deadline.tzinfo is None:
+        return deadline.replace(tzinfo=timezone.utc)
+    return deadline
+
+# Lock per chat: menjaga urutan operasi yang mengubah data dari satu chat
+# yang sama, tanpa menghalangi chat lain berjalan paralel
+# (pelengkap concurrent_updates, yang tidak menjamin urutan).
+chat_locks = defaultdict(asyncio.Lock)
+
+# Kirim notifikasi ke banyak penerima secara paralel. Dipanggil lewat
+# application.create_task supaya handler bisa selesai tanpa menunggu fanout;
+# PTB memegang referensi task-nya (bare asyncio.create_task bisa di-GC di
+# tengah jalan) dan meneruskan exception yang lolos ke error handler.
+# `messages` berisi pasangan (chat_id, teks) karena isi pesan bisa berbeda
+# per penerima (mis. memuat ID tugas masing-masing).
+async def notify_recipients(bot, messages):
+    results = await asyncio.gather(
+        *(bot.send_message(chat_id=cid, text=text, parse_mode=ParseMode.MARKDOWN) for cid, text in messages),
+        return_exceptions=True,
+    )
+    # Hasil gather urutannya sama dengan messages, jadi kegagalan bisa
+    # dilaporkan lengkap dengan chat tujuannya.
+    for (chat_id, _), result in zip(messages, results):
+        if isinstance(result, Exception):
+            logger.warning("Gagal mengirim notifikasi ke chat %s: %s", chat_id, result)
+
+def _cache_invalidate_user(user_id, username):
+    _user_cache.pop(("info", username), None)
+
+# Fungsi untuk mendapatkan user ID dan chat ID dari username.
+# maybe_single, bukan single (yang melempar APIError saat nol baris), supaya
+# jalur "tidak ditemukan" di bawah benar-benar tercapai. Catatan: saat nol
+# baris, execute() maybe_single mengembalikan None utuh — bukan response
+# dengan data=None — jadi response-nya sendiri harus dicek dulu.
 async def get_user_info_by_username(username):
-    response = supabase.table("users").select("id, chat_id").eq("username", username).single().execute()
-    if response.data:
-        return response.data['id'], response.data['chat_id']
+    cached = _cache_get(("info", username))
+    if cached:
+        return cached
+    response = await run_db(
+        get_supabase().table("users").select(USER_INFO_COLS).eq("username", username).maybe_single()
+    )
+    if response and response.data:
+        info = (response.data['id'], response.data['chat_id'])
+        _cache_set(("info", username), info)
+        return info
     return None, None
 
-# Fungsi untuk mendapatkan username dari user ID
-async def get_username_by_id(user_id):
-    response = supabase.table("users").select("username").eq("id", user_id).single().execute()
-    if response.data:
-        return response.data['username']
-    return None
-
-# Fungsi untuk mendapatkan nama lengkap dari user ID
-async def get_fullname_by_id(user_id):
-    response = supabase.table("users").select("name").eq("id", user_id).single().execute()
-    if response.data:
-        return response.data['name']
-    return None
-
 # --- Command Handlers ---
 
 # Command: /start
@@ -55,179 +290,304 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_username = user.username # Ambil username
     chat_id = update.effective_chat.id # Ambil chat_id
 
-    # Simpan/update user di tabel 'users'
-    supabase.table("users").upsert({
-        "id": user_id,
-        "name": user_name,
-        "username": user_username,
-        "chat_id": chat_id # Pastikan chat_id tersimpan
-    }).execute()
-
-    await update.message.reply_text(f"✅ Halo {user.first_name}! Bot siap pakai. Anda bisa beri dan kelola tugas.")
+    # /start yang diulang-ulang dengan profil sama tidak perlu menulis ulang
+    # ke database; cukup balas. Entri cache kedaluwarsa mengikuti TTL biasa,
+    # jadi data di database tetap segar paling lambat satu TTL kemudian.
+    profile = (user_name, user_username, chat_id)
+    if _cache_get(("profile", user_id)) == profile:
+        await update.message.reply_text(START_GREETING.format(user.first_name))
+        return
 
-# Command: /add [@penerima] [YYYY-MM-DD] [task_text]
+    # Simpan/update user di tabel 'users'. returning="minimal": hasil baris
+    # tidak pernah dipakai, jadi PostgREST tidak perlu menyusun dan mengirim
+    # balik representasinya (Prefer: return=minimal); gagal = exception.
+    # Upsert dan balasan sapaan tidak saling bergantung — jalankan paralel
+    # supaya user tidak menunggu round-trip database sebelum disapa, dan
+    # return_exceptions supaya upsert yang gagal cukup dicatat di log, bukan
+    # menyusul sapaan sukses dengan balasan error generik dari on_error.
+    upsert_result, reply_result = await asyncio.gather(
+        run_db(get_supabase().table("users").upsert({
+            "id": user_id,
+            "name": user_name,
+            "username": user_username,
+            "chat_id": chat_id # Pastikan chat_id tersimpan
+        }, returning="minimal")),
+        update.message.reply_text(START_GREETING.format(user.first_name)),
+        return_exceptions=True,
+    )
+    if isinstance(reply_result, Exception):
+        logger.warning("Gagal membalas /start dari user %s: %s", user_id, reply_result)
+    if isinstance(upsert_result, Exception):
+        # Tanpa baris di database, user belum benar-benar terdaftar —
+        # jangan isi known_users/cache supaya /start berikutnya mencoba lagi.
+        logger.warning("Gagal menyimpan profil user %s: %s", user_id, upsert_result)
+        return
+    known_users.add(user_id)
+    # Buang entri cache lama supaya perubahan nama/username langsung terbaca,
+    # lalu isi ulang dari data /start ini juga — /add yang menyebut user ini
+    # sesaat kemudian tidak perlu query lagi.
+    _cache_invalidate_user(user_id, user_username)
+    _cache_set(("profile", user_id), profile)
+    if user_username:
+        _cache_set(("info", user_username), (user_id, chat_id))
+
+# Command: /add [@penerima ...] [YYYY-MM-DD] [task_text]
 async def add_task(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        args = context.args
-        if len(args) < 3:
-            await update.message.reply_text(
-                "Contoh: /add @username_penerima 2025-12-31 Beli bahan presentasi"
-            )
-            return
+    if _rate_limited(update.effective_user.id):
+        await update.message.reply_text(RATE_LIMIT_MSG)
+        return
 
-        # Parsing argumen
-        assignee_username_raw = args[0]
-        if not assignee_username_raw.startswith('@'):
-            await update.message.reply_text("Format penerima salah. Gunakan @username.")
-            return
-        assignee_username = assignee_username_raw[1:] # Hapus '@'
-
-        deadline_str = args[1]
-        try:
-            # Menggunakan pytz untuk membuat datetime object aware of timezone (UTC disarankan)
-            # Anda mungkin perlu mengadaptasi ini jika deadline diinput dalam zona waktu lain
-            deadline = datetime.strptime(deadline_str, '%Y-%m-%d')
-            # Set to end of day in UTC for simplicity if no time is provided
-            deadline = deadline.replace(hour=23, minute=59, second=59, microsecond=0)
-            deadline = pytz.utc.localize(deadline)
-        except ValueError:
-            await update.message.reply_text("Format tanggal salah. Gunakan YYYY-MM-DD.")
-            return
+    # Pemberi tugas harus terdaftar dulu (cek set di memori, bukan query)
+    if not await is_registered(update.effective_user.id):
+        await update.message.reply_text("Ketik /start dulu sebelum memberi tugas.")
+        return
 
-        task_text = " ".join(args[2:])
-        if not task_text:
-            await update.message.reply_text("Teks tugas tidak boleh kosong.")
-            return
+    args = context.args
+    if len(args) < 3:
+        await update.message.reply_text(ADD_USAGE)
+        return
 
-        # Dapatkan ID dan Chat ID penerima
-        assignee_id, assignee_chat_id = await get_user_info_by_username(assignee_username)
+    # Kumpulkan semua @username di awal argumen (boleh lebih dari satu
+    # penerima) dalam satu lintasan; dict menjaga urutan sekaligus membuang
+    # duplikat dengan lookup O(1), bukan `in` linear per argumen.
+    seen_usernames = {}
+    arg_index = 0
+    while arg_index < len(args) and args[arg_index].startswith('@'):
+        username = args[arg_index][1:] # Hapus '@'
+        if username:
+            seen_usernames.setdefault(username)
+        arg_index += 1
+    assignee_usernames = list(seen_usernames)
+
+    if not assignee_usernames:
+        await update.message.reply_text("Format penerima salah. Gunakan @username.")
+        return
+    if len(args) - arg_index < 2:
+        await update.message.reply_text(ADD_USAGE)
+        return
 
-        if not assignee_id:
-            await update.message.reply_text(
-                f"❌ Pengguna @{assignee_username} tidak ditemukan atau belum pernah `/start` bot ini."
-            )
-            return
+    try:
+        deadline = parse_deadline(args[arg_index])
+    except ValueError:
+        await update.message.reply_text("Format tanggal salah. Gunakan YYYY-MM-DD atau bentuk relatif seperti 3hari.")
+        return
 
-        # Simpan ke tabel 'tasks'
-        response = supabase.table("tasks").insert({
+    task_text = " ".join(args[arg_index + 1:])
+    if not task_text:
+        await update.message.reply_text("Teks tugas tidak boleh kosong.")
+        return
+
+    # Resolve semua penerima sekaligus (paralel, bukan satu per satu)
+    infos = await asyncio.gather(
+        *(get_user_info_by_username(u) for u in assignee_usernames)
+    )
+    unknown = [u for u, (aid, _) in zip(assignee_usernames, infos) if not aid]
+    if unknown:
+        await update.message.reply_text(
+            f"❌ Pengguna {', '.join('@' + u for u in unknown)} tidak ditemukan "
+            f"atau belum pernah `/start` bot ini."
+        )
+        return
+
+    # Simpan ke tabel 'tasks': satu baris per penerima, dikirim sebagai
+    # satu INSERT multi-VALUES (satu round-trip, satu kali parse/plan)
+    # alih-alih satu INSERT per penerima. Lock per chat menjaga dua
+    # /add beruntun dari chat yang sama tetap tersimpan berurutan.
+    rows = [
+        {
             "task_text": task_text,
             "deadline": deadline.isoformat(), # Simpan dalam format ISO 8601
             "assigned_by": update.effective_user.id,
             "assigned_to": assignee_id,
             "status": "pending"
-        }).execute()
-
-        if response.data:
-            task_id = response.data[0]['id'] # Ambil ID tugas yang baru dibuat
-            await update.message.reply_text(
-                f"✅ Tugas berhasil ditambahkan!\n"
-                f"Untuk @{assignee_username}:\n"
-                f"📝 {task_text}\n"
-                f"🗓️ Deadline: {deadline.strftime('%d-%m-%Y')}"
-            )
-            
-            # Kirim notifikasi ke penerima tugas
-            if assignee_chat_id:
-                assigner_name = update.effective_user.full_name
-                notif_message = (
-                    f"🔔 Anda mendapatkan tugas baru dari *{assigner_name}*:\n\n"
-                    f"📝 *{task_text}*\n"
-                    f"🗓️ Deadline: _{deadline.strftime('%d-%m-%Y')}_\n\n"
-                    f"Ketik /list_my untuk melihat daftar tugas Anda."
-                )
-                await context.bot.send_message(chat_id=assignee_chat_id, text=notif_message, parse_mode='Markdown')
-            
-        else:
+        }
+        for assignee_id, _ in infos
+    ]
+    async with chat_locks[update.effective_chat.id]:
+        response = await run_db(get_supabase().table("tasks").insert(rows))
+
+        if not response.data:
             await update.message.reply_text("❌ Gagal menyimpan tugas ke database. Coba lagi nanti.")
+            return
+
+        # Daftar tugas para penerima dan daftar 'given' pemberi berubah
+        _invalidate_task_lists(
+            (aid for aid, _ in infos), (update.effective_user.id,)
+        )
+
+        mentions = ", ".join('@' + u for u in assignee_usernames)
+        deadline_label = deadline.strftime('%d-%m-%Y') # Diformat sekali, dipakai semua pesan
+        await update.message.reply_text(
+            f"✅ Tugas berhasil ditambahkan!\n"
+            f"Untuk {mentions}:\n"
+            f"📝 {task_text}\n"
+            f"🗓️ Deadline: {deadline_label}"
+        )
+
+    # Badan notifikasi disusun sekali; tiap penerima mendapat ID tugas
+    # miliknya dari hasil RETURNING INSERT tadi (response.data urutannya
+    # sama dengan rows), tanpa query tambahan. Fanout jalan di
+    # background supaya handler tidak ikut menunggu.
+    # Nama pengirim dan teks tugas berasal dari input user — di-escape
+    # sekali di sini supaya tidak merusak (atau menyusupi) Markdown,
+    # lalu fragmen aman yang sama dipakai semua notifikasi.
+    assigner_name = escape_markdown(update.effective_user.full_name)
+    safe_task_text = escape_markdown(task_text)
+    notif_body = (
+        f"🔔 Anda mendapatkan tugas baru dari *{assigner_name}*:\n\n"
+        f"📝 *{safe_task_text}*\n"
+        f"🗓️ Deadline: _{deadline_label}_\n"
+    )
+    notif_messages = [
+        (chat_id, f"{notif_body}🆔 ID: `{str(inserted['id'])[:8]}`\n\n"
+                  f"Ketik /list_my untuk melihat daftar tugas Anda.")
+        for (_, chat_id), inserted in zip(infos, response.data)
+        if chat_id
+    ]
+    if notif_messages:
+        context.application.create_task(
+            notify_recipients(context.bot, notif_messages), update=update
+        )
+
 
-    except Exception as e:
-        print(f"Error in add_task: {e}")
-        await update.message.reply_text("❌ Terjadi kesalahan saat menambahkan tugas. Pastikan format benar.")
+# Pratinjau teks tugas untuk baris daftar: dipotong dulu baru di-escape,
+# supaya elipsisnya tidak memenggal escape di tengah.
+def _task_preview(task_text):
+    if len(task_text) > TASK_TEXT_PREVIEW:
+        task_text = task_text[:TASK_TEXT_PREVIEW - 1] + "…"
+    return escape_markdown(task_text)
 
 # Command: /list_my (Untuk penerima tugas)
 async def list_my_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    
+    if _rate_limited(user_id):
+        await update.message.reply_text(RATE_LIMIT_MSG)
+        return
+
+    cached = _cache_get(("list_my", user_id))
+    if cached:
+        text, reply_markup = cached
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+        return
+
     # Ambil tugas yang di-assign ke user ini dan statusnya 'pending'
-    response = supabase.table("tasks") \
-        .select("id, task_text, deadline, assigned_by") \
-        .eq("assigned_to", user_id) \
-        .eq("status", "pending") \
-        .order("deadline", desc=False) \
-        .execute()
+    response = await run_db(
+        get_supabase().table("tasks")
+        .select(MY_TASK_COLS)
+        .eq("assigned_to", user_id)
+        .eq("status", "pending")
+        .order("deadline", desc=False)
+        .limit(LIST_LIMIT)
+    )
 
     tasks = response.data
     if not tasks:
         await update.message.reply_text("Anda tidak memiliki tugas yang pending saat ini. 🎉")
         return
 
-    message = "📝 *Daftar Tugas Anda (Pending)*:\n\n"
+    # Satu pesan untuk seluruh daftar — satu round-trip ke Telegram, bukan
+    # satu reply per tugas. Tombol 'Selesai' jadi satu baris keyboard per
+    # tugas, diberi label ID pendek supaya jelas tombol milik tugas mana.
+    lines = [MY_TASKS_HEADER]
+    keyboard = []
+    total_len = len(MY_TASKS_HEADER)
+    truncated = len(tasks) == LIST_LIMIT
     for task in tasks:
         task_id = task['id']
-        task_text = task['task_text']
+        short_id = str(task_id)[:8] # Menampilkan sebagian ID untuk identifikasi
         deadline = datetime.fromisoformat(task['deadline']).strftime('%d-%m-%Y')
-        assigner_username = await get_fullname_by_id(task['assigned_by']) or "Pengguna Tidak Dikenal"
-
-        message += (
-            f"• ID: `{str(task_id)[:8]}`\n" # Menampilkan sebagian ID untuk identifikasi
-            f"  Dari: {assigner_username}\n"
-            f"  Tugas: *{task_text}*\n"
-            f"  Deadline: {deadline}\n"
+        assigner = task.get('assigner')
+        assigner_username = (assigner and assigner['name']) or "Pengguna Tidak Dikenal"
+
+        line = MY_TASK_LINE.format(
+            short_id=short_id,
+            # Nama orang bisa mengandung _/* — tanpa escape, satu nama
+            # begitu membuat seluruh pesan ditolak Telegram
+            assigner=escape_markdown(assigner_username),
+            task_text=_task_preview(task['task_text']),
+            deadline=deadline,
+        )
+        if total_len + len(line) > LIST_CHAR_BUDGET:
+            truncated = True
+            break
+        lines.append(line)
+        total_len += len(line) + 1 # +1 newline penyambung
+        keyboard.append(
+            [InlineKeyboardButton(f"✅ Selesai {short_id}", callback_data=f"finish_task_{task_id}")]
         )
-        # Tambahkan tombol 'Selesai'
-        keyboard = [
-            [InlineKeyboardButton("✅ Selesai", callback_data=f"finish_task_{task_id}")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
-        message = "" # Reset message untuk setiap tugas
-    
-    if message: # Kirim sisa message jika ada (kasus 1 tugas)
-         await update.message.reply_text(message, parse_mode='Markdown')
+
+    if truncated:
+        lines.append(LIST_TRUNCATED_NOTE)
+    text = "\n".join(lines)
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await update.message.reply_text(text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+    # Cache diisi hanya setelah kirim sukses; render yang ditolak Telegram
+    # tidak boleh diputar ulang dari cache selama TTL berjalan
+    _cache_set(("list_my", user_id), (text, reply_markup))
 
 # Command: /list_given (Untuk pemberi tugas)
 async def list_given_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    
+    if _rate_limited(user_id):
+        await update.message.reply_text(RATE_LIMIT_MSG)
+        return
+
+    cached = _cache_get(("list_given", user_id))
+    if cached:
+        text, reply_markup = cached
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+        return
+
     # Ambil tugas yang diberikan oleh user ini
-    response = supabase.table("tasks") \
-        .select("id, task_text, deadline, assigned_to, status") \
-        .eq("assigned_by", user_id) \
-        .order("created_at", desc=True) \
-        .execute()
+    response = await run_db(
+        get_supabase().table("tasks")
+        .select(GIVEN_TASK_COLS)
+        .eq("assigned_by", user_id)
+        .order("created_at", desc=True)
+        .limit(LIST_LIMIT)
+    )
 
     tasks = response.data
     if not tasks:
         await update.message.reply_text("Anda belum memberikan tugas apapun. 🤔")
         return
 
-    message = "📋 *Daftar Tugas yang Anda Berikan*:\n\n"
+    # Sama seperti /list_my: seluruh daftar dalam satu pesan, tombol
+    # 'Batalkan' hanya untuk tugas yang masih pending.
+    lines = [GIVEN_TASKS_HEADER]
+    keyboard = []
+    total_len = len(GIVEN_TASKS_HEADER)
+    truncated = len(tasks) == LIST_LIMIT
     for task in tasks:
         task_id = task['id']
-        task_text = task['task_text']
+        short_id = str(task_id)[:8]
         deadline = datetime.fromisoformat(task['deadline']).strftime('%d-%m-%Y')
-        assignee_username = await get_fullname_by_id(task['assigned_to']) or "Pengguna Tidak Dikenal"
-        status = task['status'].capitalize()
-
-        message += (
-            f"• ID: `{str(task_id)[:8]}`\n"
-            f"  Untuk: {assignee_username}\n"
-            f"  Tugas: *{task_text}*\n"
-            f"  Deadline: {deadline}\n"
-            f"  Status: `{status}`\n"
+        assignee = task.get('assignee')
+        assignee_username = (assignee and assignee['name']) or "Pengguna Tidak Dikenal"
+
+        line = GIVEN_TASK_LINE.format(
+            short_id=short_id,
+            assignee=escape_markdown(assignee_username),
+            task_text=_task_preview(task['task_text']),
+            deadline=deadline,
+            status=task['status'].capitalize(),
         )
-        
-        keyboard_buttons = []
+        if total_len + len(line) > LIST_CHAR_BUDGET:
+            truncated = True
+            break
+        lines.append(line)
+        total_len += len(line) + 1
         if task['status'] == 'pending':
-            keyboard_buttons.append(InlineKeyboardButton("❌ Batalkan Tugas", callback_data=f"cancel_task_{task_id}"))
-        
-        if keyboard_buttons:
-            reply_markup = InlineKeyboardMarkup([keyboard_buttons])
-            await update.message.reply_text(message, reply_markup=reply_markup, parse_mode='Markdown')
-        else:
-            await update.message.reply_text(message, parse_mode='Markdown')
-        
-        message = "" # Reset message untuk setiap tugas
+            keyboard.append(
+                [InlineKeyboardButton(f"❌ Batalkan {short_id}", callback_data=f"cancel_task_{task_id}")]
+            )
+
+    if truncated:
+        lines.append(LIST_TRUNCATED_NOTE)
+    text = "\n".join(lines)
+    reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+    await update.message.reply_text(text, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+    _cache_set(("list_given", user_id), (text, reply_markup))
 
 # --- Callback Query Handler (Untuk tombol inline) ---
 async def handle_button_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -237,86 +597,162 @@ async def handle_button_click(update: Update, context: ContextTypes.DEFAULT_TYPE
     data = query.data
     user_id = query.from_user.id
 
+    if data.startswith("finish_task_"):
+        task_id = data.split("_")[2]
+
+        # Cek apakah user adalah penerima tugas
+        task_resp = await run_db(
+            get_supabase().table("tasks").select("assigned_to, task_text, assigned_by").eq("id", task_id).maybe_single()
+        )
+        if not task_resp or not task_resp.data or task_resp.data['assigned_to'] != user_id:
+            await query.edit_message_text("❌ Anda tidak punya izin untuk menyelesaikan tugas ini.")
+            return
+
+        # Update status di database
+        update_resp = await run_db(
+            get_supabase().table("tasks").update({"status": "finished"}).eq("id", task_id)
+        )
+
+        if update_resp.data:
+            _invalidate_task_lists((user_id,), (task_resp.data['assigned_by'],))
+            await query.edit_message_text(f"✅ Tugas '{task_resp.data['task_text']}' berhasil ditandai Selesai.")
+            # Kirim notifikasi ke pemberi tugas
+            assigner_resp = await run_db(
+                get_supabase().table("users").select("chat_id").eq("id", task_resp.data['assigned_by']).maybe_single()
+            )
+            assigner_chat_id = assigner_resp.data['chat_id'] if assigner_resp and assigner_resp.data else None
+            if assigner_chat_id:
+                assignee_name = query.from_user.full_name
+                await context.bot.send_message(
+                    chat_id=assigner_chat_id,
+                    text=f"🎉 Tugas '{task_resp.data['task_text']}' telah diselesaikan oleh *{assignee_name}*!"
+                )
+        else:
+            await query.edit_message_text("❌ Gagal menandai tugas selesai. Coba lagi.")
+
+    elif data.startswith("cancel_task_"):
+        task_id = data.split("_")[2]
+
+        # Cek apakah user adalah pemberi tugas
+        task_resp = await run_db(
+            get_supabase().table("tasks").select("assigned_by, task_text, assigned_to").eq("id", task_id).maybe_single()
+        )
+        if not task_resp or not task_resp.data or task_resp.data['assigned_by'] != user_id:
+            await query.edit_message_text("❌ Anda tidak punya izin untuk membatalkan tugas ini.")
+            return
+
+        # Update status di database
+        update_resp = await run_db(
+            get_supabase().table("tasks").update({"status": "cancelled"}).eq("id", task_id)
+        )
+
+        if update_resp.data:
+            _invalidate_task_lists((task_resp.data['assigned_to'],), (user_id,))
+            await query.edit_message_text(f"❌ Tugas '{task_resp.data['task_text']}' berhasil dibatalkan.")
+            # Kirim notifikasi ke penerima tugas
+            assignee_resp = await run_db(
+                get_supabase().table("users").select("chat_id").eq("id", task_resp.data['assigned_to']).maybe_single()
+            )
+            assignee_chat_id = assignee_resp.data['chat_id'] if assignee_resp and assignee_resp.data else None
+            if assignee_chat_id:
+                assigner_name = query.from_user.full_name
+                await context.bot.send_message(
+                    chat_id=assignee_chat_id,
+                    text=f"🚫 Tugas '{task_resp.data['task_text']}' telah dibatalkan oleh *{assigner_name}*."
+                )
+        else:
+            await query.edit_message_text("❌ Gagal membatalkan tugas. Coba lagi.")
+
+
+
+# --- Error Handler Global ---
+# Dipanggil PTB untuk exception apa pun yang lolos dari handler, jadi tiap
+# handler tidak perlu membungkus seluruh badannya dengan except Exception;
+# cukup menangani error yang memang diantisipasi (mis. ValueError tanggal).
+async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
+    # exc_info=context.error supaya traceback lengkap ikut tercatat
+    logger.error("Exception saat memproses update:", exc_info=context.error)
+    if not isinstance(update, Update):
+        return
     try:
-        if data.startswith("finish_task_"):
-            task_id = data.split("_")[2]
-
-            # Cek apakah user adalah penerima tugas
-            task_resp = supabase.table("tasks").select("assigned_to, task_text, assigned_by").eq("id", task_id).single().execute()
-            if not task_resp.data or task_resp.data['assigned_to'] != user_id:
-                await query.edit_message_text("❌ Anda tidak punya izin untuk menyelesaikan tugas ini.")
-                return
-
-            # Update status di database
-            update_resp = supabase.table("tasks").update({"status": "finished"}).eq("id", task_id).execute()
-            
-            if update_resp.data:
-                await query.edit_message_text(f"✅ Tugas '{task_resp.data['task_text']}' berhasil ditandai Selesai.")
-                # Kirim notifikasi ke pemberi tugas
-                assigner_chat_id = (await supabase.table("users").select("chat_id").eq("id", task_resp.data['assigned_by']).single().execute()).data['chat_id']
-                if assigner_chat_id:
-                    assignee_name = query.from_user.full_name
-                    await context.bot.send_message(
-                        chat_id=assigner_chat_id,
-                        text=f"🎉 Tugas '{task_resp.data['task_text']}' telah diselesaikan oleh *{assignee_name}*!"
-                    )
-            else:
-                await query.edit_message_text("❌ Gagal menandai tugas selesai. Coba lagi.")
-
-        elif data.startswith("cancel_task_"):
-            task_id = data.split("_")[2]
-
-            # Cek apakah user adalah pemberi tugas
-            task_resp = supabase.table("tasks").select("assigned_by, task_text, assigned_to").eq("id", task_id).single().execute()
-            if not task_resp.data or task_resp.data['assigned_by'] != user_id:
-                await query.edit_message_text("❌ Anda tidak punya izin untuk membatalkan tugas ini.")
-                return
-
-            # Update status di database
-            update_resp = supabase.table("tasks").update({"status": "cancelled"}).eq("id", task_id).execute()
-
-            if update_resp.data:
-                await query.edit_message_text(f"❌ Tugas '{task_resp.data['task_text']}' berhasil dibatalkan.")
-                # Kirim notifikasi ke penerima tugas
-                assignee_chat_id = (await supabase.table("users").select("chat_id").eq("id", task_resp.data['assigned_to']).single().execute()).data['chat_id']
-                if assignee_chat_id:
-                    assigner_name = query.from_user.full_name
-                    await context.bot.send_message(
-                        chat_id=assignee_chat_id,
-                        text=f"🚫 Tugas '{task_resp.data['task_text']}' telah dibatalkan oleh *{assigner_name}*."
-                    )
-            else:
-                await query.edit_message_text("❌ Gagal membatalkan tugas. Coba lagi.")
-
-    except Exception as e:
-        print(f"Error in handle_button_click: {e}")
-        await query.edit_message_text("❌ Terjadi kesalahan saat memproses aksi Anda.")
-
-
-# --- Webhook Handler (Untuk Render) ---
-@flask_app.route("/webhook", methods=["POST"])
-def webhook():
-    # Pastikan ini menggunaka bot_app.bot (instance Bot di dalam Application)
-    update = Update.de_json(request.get_json(), bot_app.bot)
-    bot_app.process_update(update)
-    return "OK", 200
+        if update.callback_query:
+            await update.callback_query.edit_message_text("❌ Terjadi kesalahan saat memproses aksi Anda.")
+        elif update.effective_message:
+            await update.effective_message.reply_text("❌ Terjadi kesalahan. Pastikan format perintah benar.")
+    except Exception:
+        pass # Jangan sampai error handler sendiri melempar lagi
+
+# --- Pendaftaran Handler ---
+# Daftar handler dibangun sekali di scope modul (termasuk objek
+# CommandHandler-nya); pendaftaran di main tinggal satu panggilan.
+HANDLERS = (
+    CommandHandler("start", start),
+    CommandHandler("add", add_task),
+    CommandHandler("list_my", list_my_tasks),
+    CommandHandler("list_given", list_given_tasks),
+    CallbackQueryHandler(handle_button_click),
+)
 
 # --- Main Execution ---
+
+# Bangun Application PTB lengkap dengan handler-nya. Dipisah dari blok
+# __main__ supaya modul ini bisa di-import (mis. dari script lain atau
+# interpreter) tanpa efek samping membangun bot.
+# concurrent_updates: proses update dari chat berbeda secara paralel,
+# bukan satu per satu — tanpa ini satu handler lambat menahan semua chat.
+def build_application():
+    app = (
+        Application.builder()
+        .token(CONFIG.token)
+        .concurrent_updates(True)
+        # HTTP/2 ke api.telegram.org: fanout notifikasi paralel berbagi satu
+        # koneksi multiplexed, bukan antre rebutan koneksi HTTP/1.1
+        .http_version("2")
+        # Pool default httpx cuma 1 koneksi; saat fanout notifikasi + balasan
+        # berbarengan itu jadi antrean "pool is full". 64 koneksi cukup untuk
+        # burst wajar, dan timeout eksplisit supaya request macet tidak
+        # menggantung handler tanpa batas.
+        .connection_pool_size(64)
+        .pool_timeout(30)
+        .connect_timeout(10)
+        .read_timeout(30)
+        # Limiter bawaan PTB mengantre kiriman keluar di bawah batas 30
+        # pesan/detik Telegram dan mengulang sendiri saat kena RetryAfter,
+        # jadi fanout notifikasi besar tidak memicu banjir 429 di handler.
+        .rate_limiter(AIORateLimiter())
+        .post_init(lambda app: load_known_users())
+        .build()
+    )
+    app.add_handlers(HANDLERS)
+    app.add_error_handler(on_error)
+    return app
+
+def main():
+    # Pakai uvloop kalau tersedia: implementasi event loop berbasis libuv
+    # dengan overhead syscall/scheduling lebih rendah dari loop bawaan.
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass # Tetap jalan dengan event loop standar
+
+    bot_app = build_application()
+
+    # Jalankan server webhook bawaan PTB (async, satu event loop bersama
+    # bot). Update dari Telegram langsung masuk ke antrian async Application
+    # tanpa lewat worker thread WSGI, dan webhook-nya otomatis didaftarkan
+    # ke Telegram saat start. Untuk testing lokal bisa pakai:
+    # bot_app.run_polling(poll_interval=3)
+    # secret_token ikut didaftarkan ke Telegram; request tanpa header
+    # X-Telegram-Bot-Api-Secret-Token yang cocok ditolak PTB sebelum
+    # payload-nya di-parse, jadi POST iseng ke /webhook nyaris gratis.
+    bot_app.run_webhook(
+        listen="0.0.0.0",
+        port=CONFIG.port,
+        url_path="webhook",
+        webhook_url=f"{CONFIG.webhook_url}/webhook",
+        secret_token=CONFIG.webhook_secret,
+    )
+
 if __name__ == "__main__":
-    # Register command handlers
-    bot_app.add_handler(CommandHandler("start", start))
-    bot_app.add_handler(CommandHandler("add", add_task))
-    bot_app.add_handler(CommandHandler("list_my", list_my_tasks))
-    bot_app.add_handler(CommandHandler("list_given", list_given_tasks))
-
-    # Register callback query handler for inline buttons
-    bot_app.add_handler(CallbackQueryHandler(handle_button_click))
-    
-    # Run Flask app (which handles webhooks)
-    # Ini akan dijalankan oleh Gunicorn di Render
-    # Untuk local testing, Anda bisa uncomment baris di bawah ini dan comment baris flask_app.run()
-    # bot_app.run_polling(poll_interval=3) # Contoh untuk mode polling saat testing lokal
-    
-    # Jalankan Flask app untuk webhook (di Render, Gunicorn yang memanggil ini)
-    # Ini adalah titik masuk utama aplikasi web Anda
-    flask_app.run(host='0.0.0.0', port=int(os.getenv("PORT", 8080)))
+    main()
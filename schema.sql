@@ -0,0 +1,36 @@
+-- Skema database Supabase untuk wgtodo_bot.
+-- Jalankan lewat SQL editor Supabase; semua statement idempoten
+-- (IF NOT EXISTS) sehingga aman dijalankan ulang.
+
+CREATE TABLE IF NOT EXISTS users (
+    id BIGINT PRIMARY KEY, -- Telegram user id; lookup per id cukup lewat PK
+    name TEXT,
+    username TEXT,
+    chat_id BIGINT
+);
+
+-- /add mencari penerima berdasarkan username
+CREATE INDEX IF NOT EXISTS users_username_idx ON users (username);
+
+-- Satu baris tasks per penerima (assigned_to BIGINT), BUKAN satu baris per
+-- tugas dengan daftar penerima berupa TEXT dipisah spasi. Dengan begitu
+-- filter per penerima memakai index biasa, tanpa split string di aplikasi,
+-- dan status tiap penerima bisa berubah sendiri-sendiri.
+CREATE TABLE IF NOT EXISTS tasks (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    task_text TEXT NOT NULL,
+    deadline TIMESTAMPTZ,
+    assigned_by BIGINT REFERENCES users (id),
+    assigned_to BIGINT REFERENCES users (id),
+    status TEXT NOT NULL DEFAULT 'pending',
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- /list_my: filter assigned_to + status, urut deadline — satu index
+-- majemuk melayani filter sekaligus pengurutannya
+CREATE INDEX IF NOT EXISTS tasks_assigned_to_status_deadline_idx
+    ON tasks (assigned_to, status, deadline);
+
+-- /list_given: filter assigned_by, urut created_at terbaru
+CREATE INDEX IF NOT EXISTS tasks_assigned_by_created_at_idx
+    ON tasks (assigned_by, created_at DESC);